@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""List RunPod network volumes and SSH keys with a single GraphQL request."""
+
+import base64
+import binascii
+import hashlib
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+from typing import Dict, Any
+
+# Read API key
+api_key = Path.home() / ".runpod_api_key.txt"
+key = api_key.read_text().strip()
+
+# GraphQL query fetching both network volumes and the SSH key
+query = """
+query Bootstrap {
+  myself {
+    pubKey
+    networkVolumes {
+      id
+      name
+      size
+      dataCenterId
+    }
+  }
+}
+"""
+
+
+def key_fingerprint(pub_key: str) -> bytes:
+    """Return the SHA256 digest of the key blob in one OpenSSH public key line.
+
+    The blob is the field following the key type, so leading options and
+    trailing comments are ignored. Raises ValueError if no key is found.
+    """
+    fields = pub_key.split()
+    for key_type, blob in zip(fields, fields[1:]):
+        try:
+            decoded = base64.b64decode(blob, validate=True)
+        except binascii.Error:
+            continue
+        # A key blob starts with its length-prefixed key type
+        type_bytes = key_type.encode()
+        if decoded[:4] == len(type_bytes).to_bytes(4, "big") and decoded[4:4 + len(type_bytes)] == type_bytes:
+            return hashlib.sha256(decoded).digest()
+    raise ValueError("no OpenSSH public key found")
+
+
+def fetch_bootstrap() -> Dict[str, Any]:
+    """Fetch network volumes and SSH key in one request and return the parsed response."""
+    request = urllib.request.Request(
+        "https://api.runpod.io/graphql?" + urllib.parse.urlencode({"api_key": key}),
+        data=json.dumps({"query": query}).encode(),
+        headers={"Content-Type": "application/json"}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        # Non-2xx responses still carry a GraphQL error body worth showing
+        body = e.read()
+        try:
+            return json.loads(body)
+        except ValueError:
+            return {"errors": [{"message": f"HTTP {e.code}: {body.decode(errors='replace')}"}]}
+
+
+def print_network_volumes(data: Dict[str, Any]):
+    """Print the network volumes from a bootstrap response."""
+    if "data" in data and "myself" in data["data"]:
+        volumes = data["data"]["myself"]["networkVolumes"]
+
+        if not volumes:
+            print("No network volumes found.")
+        else:
+            print(f"Found {len(volumes)} network volume(s):\n")
+            for vol in volumes:
+                print(f"Name: {vol['name']}")
+                print(f"ID: {vol['id']}")
+                print(f"Size: {vol['size']} GB")
+                print(f"Datacenter: {vol['dataCenterId']}")
+                print("-" * 50)
+    else:
+        print("Error fetching network volumes:")
+        print(json.dumps(data, indent=2))
+
+
+def print_ssh_keys(data: Dict[str, Any]):
+    """Print the SSH key from a bootstrap response and compare it to the runpodctl key."""
+    if "data" in data and "myself" in data["data"]:
+        pub_key = data["data"]["myself"].get("pubKey")
+
+        if not pub_key:
+            print("No SSH key found in RunPod account.")
+        else:
+            print("SSH Public Key registered in RunPod account:\n")
+            print(pub_key)
+            print("\n" + "=" * 70)
+
+            # Check if it matches runpodctl key
+            runpod_key_path = Path.home() / ".runpod" / "ssh" / "RunPod-Key-Go.pub"
+            if runpod_key_path.exists():
+                runpod_key = runpod_key_path.read_text().strip()
+
+                # The account may hold several keys, one per line
+                account_fingerprints = set()
+                for line in pub_key.splitlines():
+                    try:
+                        account_fingerprints.add(key_fingerprint(line))
+                    except ValueError:
+                        continue
+                try:
+                    runpod_fingerprint = key_fingerprint(runpod_key)
+                except ValueError:
+                    runpod_fingerprint = None
+                if not account_fingerprints or runpod_fingerprint is None:
+                    print("⚠ Could not parse SSH keys to compare with the runpodctl key (RunPod-Key-Go)")
+                    return
+
+                if runpod_fingerprint in account_fingerprints:
+                    print("✓ This matches the runpodctl key (RunPod-Key-Go)")
+                else:
+                    print("✗ This does NOT match the runpodctl key (RunPod-Key-Go)")
+                    print("\nThis is the issue! The pod is using a different SSH key.")
+    else:
+        print("Error fetching SSH keys:")
+        print(json.dumps(data, indent=2))
+
+
+if __name__ == "__main__":
+    data = fetch_bootstrap()
+    print_network_volumes(data)
+    print()
+    print_ssh_keys(data)
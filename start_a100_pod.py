@@ -8,14 +8,131 @@ Exposes SSH over TCP with public IP for direct access
 When ready, it will add the pod to SSH known_hosts and launch VSCode
 """
 
+import hashlib
+import json
 import os
+import random
+import shutil
+import socket
 import sys
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional, Tuple, Dict, Any
 
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode()
+
 VSCODE_START_DIR = '/workspace/assignment5-alignment'
+POLL_TIMEOUT_SECONDS = 300
+SSH_READY_TIMEOUT_SECONDS = 20
+GRAPHQL_URL = "https://api.runpod.io/graphql"
+
+# Pod query used on every poll; its JSON-encoded form is built once
+POD_INFO_QUERY = """
+query Pod($input: PodFilter!) {
+  pod(input: $input) {
+    runtime {
+      ports {
+        ip
+        isIpPublic
+        privatePort
+        publicPort
+      }
+    }
+  }
+}
+"""
+_POD_INFO_QUERY_JSON = json_dumps(POD_INFO_QUERY)
+# Automatic persisted query extension, so polls can send the hash instead of the text
+_POD_INFO_APQ_JSON = json_dumps({
+    "persistedQuery": {"version": 1, "sha256Hash": hashlib.sha256(POD_INFO_QUERY.encode()).hexdigest()}
+})
+
+
+def backoff_delay(attempt: int) -> float:
+    """Capped exponential backoff (1s, 2s, 4s, 8s, 8s, ...) with a little jitter."""
+    return min(8, 1 * 2 ** min(attempt - 1, 3)) + random.random() * 0.25
+
+
+def wait_for_port(host: str, port: str, timeout: float) -> bool:
+    """Wait until host:port accepts TCP connections; return False on timeout."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, int(port)), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.5)
+    return False
+
+
+def persisted_query_error(result: Dict[str, Any]) -> Optional[str]:
+    """Return "PersistedQueryNotFound" or "PersistedQueryNotSupported" if the response reports it."""
+    codes = {
+        "PERSISTED_QUERY_NOT_FOUND": "PersistedQueryNotFound",
+        "PERSISTED_QUERY_NOT_SUPPORTED": "PersistedQueryNotSupported",
+    }
+    for error in result.get("errors") or []:
+        if not isinstance(error, dict):
+            continue
+        message = error.get("message")
+        if message in codes.values():
+            return message
+        code = (error.get("extensions") or {}).get("code")
+        if code in codes:
+            return codes[code]
+    return None
+
+
+def host_key_of(known_hosts_line: str) -> Optional[Tuple[str, str]]:
+    """Return the (key type, base64 key) of a known_hosts line, or None for comments/blanks."""
+    fields = known_hosts_line.split()
+    if fields and fields[0].startswith("@"):
+        fields = fields[1:]  # Drop @cert-authority / @revoked markers
+    if len(fields) < 3 or fields[0].startswith("#"):
+        return None
+    return fields[1], fields[2]
+
+
+class StatusLine:
+    """Poll status output: one rewritten line on a terminal, one line per attempt otherwise."""
+
+    def __init__(self):
+        self.is_tty = sys.stdout.isatty()
+        self.pending = False
+
+    def update(self, attempt: int, status: str):
+        """Report the status of a poll attempt."""
+        line = f"  Attempt {attempt} - {status}"
+        if not self.is_tty:
+            print(line)
+            return
+
+        # Clearing only reaches the last visual row, so never let the line wrap or
+        # span several lines (error text may be a multi-line HTML body)
+        line = "  " + " ".join(line.split())
+        width = shutil.get_terminal_size().columns
+        sys.stdout.write("\x1b[2K\r" + line[:max(width - 1, 1)])
+        sys.stdout.flush()
+        self.pending = True
+
+    def finish(self):
+        """End the pending status line, if any, before printing anything else."""
+        if self.pending:
+            sys.stdout.write("\n")
+            sys.stdout.flush()
+            self.pending = False
 
 
 class PodManager:
@@ -32,6 +149,28 @@ class PodManager:
             sys.exit(1)
         self.api_key = self.api_key_path.read_text().strip()
 
+        # Persistent HTTP session so polling reuses one TLS connection
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        self.session.params = {"api_key": self.api_key}
+        # Retry transient failures in the connection layer. The pod-creation
+        # mutation goes through this session too, so only retry cases where the
+        # server cannot have acted on the request (connect errors, 429, 503).
+        self.session.mount("https://", HTTPAdapter(max_retries=Retry(
+            total=5,
+            read=0,
+            backoff_factor=0.5,
+            status_forcelist=(429, 503),
+            allowed_methods=frozenset(["POST"]),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )))
+
+        # Persisted query state for the pod polling query
+        self.apq_enabled = True
+        self.apq_registered = False
+        self.apq_confirmed = False  # Set once a hash-only request has succeeded
+
         # Read SSH public key
         ssh_pub_key_path = self.home / ".ssh" / "id_rsa.pub"
         if ssh_pub_key_path.exists():
@@ -55,32 +194,43 @@ class PodManager:
         self.ports = "22/tcp,8888/http"
         self.volume_mount_path = "/workspace"
 
-    def graphql_request(self, query: str, variables: Optional[Dict] = None) -> Dict[str, Any]:
+    def graphql_request(self, query: str, variables: Optional[Dict] = None,
+                        check_errors: bool = True) -> Dict[str, Any]:
         """Make a GraphQL request to RunPod API."""
-        response = requests.post(
-            "https://api.runpod.io/graphql",
-            headers={
-                "Content-Type": "application/json",
-            },
-            params={"api_key": self.api_key},
-            json={
-                "query": query,
-                "variables": variables or {}
-            }
-        )
+        return self.post_graphql(json_dumps({
+            "query": query,
+            "variables": variables or {}
+        }), check_errors=check_errors)
 
-        if response.status_code != 200:
-            raise Exception(f"HTTP {response.status_code}: {response.text}")
+    def post_graphql(self, body: bytes, check_errors: bool = True) -> Dict[str, Any]:
+        """POST an already JSON-encoded GraphQL request body to RunPod API.
 
-        data = response.json()
+        With check_errors=False, a response carrying GraphQL errors is returned
+        instead of raised, so partial data can still be inspected.
+        """
+        response = self.session.post(GRAPHQL_URL, data=body, timeout=30)
 
-        if "errors" in data:
+        if response.status_code != 200:
+            # Some servers send GraphQL errors with a 4xx status; 5xx are server faults
+            data = None
+            if not check_errors and response.status_code < 500:
+                try:
+                    data = json_loads(response.content)
+                except ValueError:
+                    pass
+            if not isinstance(data, dict) or "errors" not in data:
+                raise Exception(f"HTTP {response.status_code}: {response.text}")
+            return data
+
+        data = json_loads(response.content)
+
+        if check_errors and "errors" in data:
             raise Exception(f"GraphQL errors: {data['errors']}")
 
         return data
 
-    def create_pod(self) -> str:
-        """Create the RunPod pod using GraphQL API and return its ID."""
+    def create_pod(self) -> Tuple[str, Dict[str, Any]]:
+        """Create the RunPod pod using GraphQL API and return its ID and initial pod data."""
         print("\nCreating A100 PCIe pod in Secure Cloud...")
         print(f"  GPU Type: {self.gpu_type_id}")
         print(f"  GPU Count: {self.gpu_count}")
@@ -105,6 +255,14 @@ class PodManager:
             machine {
               podHostId
             }
+            runtime {
+              ports {
+                ip
+                isIpPublic
+                privatePort
+                publicPort
+              }
+            }
           }
         }
         """
@@ -138,14 +296,21 @@ class PodManager:
             }
         }
 
+        pod_id = None
         try:
-            result = self.graphql_request(mutation, variables)
-
-            if "data" not in result or "podFindAndDeployOnDemand" not in result["data"]:
+            # Errors are checked by hand: the pod may have been deployed (and billed)
+            # even if resolving some selected field failed
+            result = self.graphql_request(mutation, variables, check_errors=False)
+
+            pod_data = (result.get("data") or {}).get("podFindAndDeployOnDemand")
+            if not pod_data or not pod_data.get("id"):
+                if "errors" in result:
+                    raise Exception(f"GraphQL errors: {result['errors']}")
                 raise Exception(f"Unexpected response: {result}")
 
-            pod_data = result["data"]["podFindAndDeployOnDemand"]
             pod_id = pod_data["id"]
+            if "errors" in result:
+                print(f"\n⚠ Pod was created, but the response had errors: {result['errors']}")
             cost_per_hr = pod_data.get("costPerHr")
 
             print(f"\n✓ Pod created successfully!")
@@ -154,98 +319,107 @@ class PodManager:
                 raise ValueError("Hourly cost not found in API response")
             print(f"  Hourly Cost: ${cost_per_hr:.3f}/hr")
 
-            return pod_id
+            return pod_id, pod_data
 
         except Exception as e:
             print(f"\n✗ Failed to create pod: {e}")
+            if pod_id:
+                print(f"  Pod {pod_id} was created and may be billing.")
+                print(f"  Stop it at https://runpod.io/console/pods")
             sys.exit(1)
 
     def get_pod_info(self, pod_id: str) -> Dict[str, Any]:
-        """Get pod information using GraphQL API."""
-        query = """
-        query Pod($input: PodFilter!) {
-          pod(input: $input) {
-            id
-            name
-            desiredStatus
-            runtime {
-              uptimeInSeconds
-              ports {
-                ip
-                isIpPublic
-                privatePort
-                publicPort
-                type
-              }
-              gpus {
-                id
-                gpuUtilPercent
-                memoryUtilPercent
-              }
-            }
-          }
-        }
-        """
-
-        variables = {"input": {"podId": pod_id}}
+        """Get pod runtime port information using GraphQL API."""
+        variables = json_dumps({"input": {"podId": pod_id}})
+        plain_body = b'{"query":' + _POD_INFO_QUERY_JSON + b',"variables":' + variables + b'}'
 
-        result = self.graphql_request(query, variables)
+        if not self.apq_enabled:
+            result = self.post_graphql(plain_body)
+        else:
+            result = self.post_graphql(
+                b'{"variables":' + variables + b',"extensions":' + _POD_INFO_APQ_JSON + b'}',
+                check_errors=False
+            )
+            error = persisted_query_error(result)
+            if error is None and "errors" in result and not result.get("data") and not self.apq_confirmed:
+                # A generic rejection (e.g. "Must provide query string.") before any
+                # hash-only success means the server does not support APQ at all
+                result = self.post_graphql(plain_body, check_errors=False)
+                if "errors" not in result:
+                    self.apq_enabled = False
+            elif error is None and "errors" not in result:
+                self.apq_confirmed = True
+            if error == "PersistedQueryNotFound":
+                if self.apq_registered:
+                    # Already registered once, so the server does not keep persisted queries
+                    self.apq_enabled = False
+                    result = self.post_graphql(plain_body, check_errors=False)
+                else:
+                    # Not persisted yet: send the full text, which registers it
+                    self.apq_registered = True
+                    result = self.post_graphql(
+                        plain_body[:-1] + b',"extensions":' + _POD_INFO_APQ_JSON + b'}',
+                        check_errors=False
+                    )
+                error = persisted_query_error(result)
+            if error == "PersistedQueryNotSupported":
+                self.apq_enabled = False
+                result = self.post_graphql(plain_body, check_errors=False)
+            if "errors" in result:
+                raise Exception(f"GraphQL errors: {result['errors']}")
 
         if "data" in result and "pod" in result["data"]:
             return result["data"]["pod"]
         else:
             raise Exception(f"Failed to get pod info: {result}")
 
-    def wait_for_pod_running(self, pod_id: str, max_attempts: int = 60):
-        """Wait for the pod to be in RUNNING state."""
-        print("\nWaiting for pod to start...")
-
-        for attempt in range(1, max_attempts + 1):
-            try:
-                pod_info = self.get_pod_info(pod_id)
-
-                # Check if pod has runtime (meaning it's running)
-                if pod_info.get("runtime"):
-                    print("✓ Pod is now running!")
-                    return
-
-                print(f"  Attempt {attempt}/{max_attempts} - Pod not ready yet...")
-                time.sleep(5)
+    def wait_for_pod_ready(self, pod_id: str, initial_pod_info: Optional[Dict[str, Any]] = None,
+                           timeout: float = POLL_TIMEOUT_SECONDS,
+                           ssh_timeout: float = POLL_TIMEOUT_SECONDS) -> Tuple[str, str]:
+        """Wait for the pod to be running with SSH exposed; return SSH host and port.
 
-            except Exception as e:
-                print(f"  Attempt {attempt}/{max_attempts} - Error: {e}")
-                time.sleep(5)
-
-        print("✗ Error: Pod did not start within timeout period")
-        sys.exit(1)
-
-    def get_ssh_details(self, pod_id: str) -> Tuple[str, str]:
-        """Get SSH host and port from pod information via GraphQL API."""
-        print("\nGetting SSH connection details...")
+        The pod gets timeout seconds to start running, and then ssh_timeout seconds
+        from that point to expose its SSH port. If initial_pod_info is given (e.g.
+        from the create mutation), it is used in place of the first poll.
+        """
+        print("\nWaiting for pod to start...")
 
-        max_attempts = 40
-        for attempt in range(1, max_attempts + 1):
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        running = False
+        status = StatusLine()
+        while time.monotonic() < deadline:
+            attempt += 1
             try:
-                pod_info = self.get_pod_info(pod_id)
+                if initial_pod_info is not None:
+                    pod_info, initial_pod_info = initial_pod_info, None
+                else:
+                    pod_info = self.get_pod_info(pod_id)
+                runtime = pod_info.get("runtime")
 
-                # Check if runtime and ports are available
-                if not pod_info.get("runtime") or not pod_info["runtime"].get("ports"):
-                    print(f"  Attempt {attempt}/{max_attempts} - Waiting for SSH port to be exposed...")
-                    time.sleep(5)
+                # A runtime means the pod is running
+                if not runtime:
+                    status.update(attempt, "Pod not ready yet...")
+                    time.sleep(backoff_delay(attempt))
                     continue
 
+                if not running:
+                    status.finish()
+                    print("✓ Pod is now running!")
+                    running = True
+                    # The SSH port gets its own window, starting now
+                    deadline = time.monotonic() + ssh_timeout
+
                 # Find the SSH port (privatePort 22)
-                ports = pod_info["runtime"]["ports"]
                 ssh_port_info = None
-
-                for port in ports:
+                for port in runtime.get("ports") or []:
                     if port.get("privatePort") == 22:
                         ssh_port_info = port
                         break
 
                 if not ssh_port_info:
-                    print(f"  Attempt {attempt}/{max_attempts} - SSH port not found yet...")
-                    time.sleep(5)
+                    status.update(attempt, "Waiting for SSH port to be exposed...")
+                    time.sleep(backoff_delay(attempt))
                     continue
 
                 ssh_host = ssh_port_info.get("ip")
@@ -253,30 +427,58 @@ class PodManager:
                 is_public = ssh_port_info.get("isIpPublic", False)
 
                 if ssh_host and ssh_port:
+                    status.finish()
                     print(f"✓ SSH connection details obtained")
                     print(f"  Host: {ssh_host}")
                     print(f"  Port: {ssh_port}")
                     print(f"  Public IP: {is_public}")
                     return ssh_host, ssh_port
                 else:
-                    print(f"  Attempt {attempt}/{max_attempts} - SSH details incomplete...")
-                    time.sleep(5)
+                    status.update(attempt, "SSH details incomplete...")
+                    time.sleep(backoff_delay(attempt))
 
             except Exception as e:
-                print(f"  Attempt {attempt}/{max_attempts} - Error: {e}")
-                time.sleep(5)
+                status.update(attempt, f"Error: {e}")
+                time.sleep(backoff_delay(attempt))
 
-        print("✗ Error: Could not get SSH connection details within timeout period")
+        status.finish()
+        if running:
+            print("✗ Error: Could not get SSH connection details within timeout period")
+        else:
+            print("✗ Error: Pod did not start within timeout period")
         sys.exit(1)
 
-    def add_to_known_hosts(self, ssh_host: str, ssh_port: str):
-        """Add the pod to SSH known_hosts."""
-        print("\nAdding pod to SSH known_hosts...")
+    def known_hosts_name(self, ssh_host: str, ssh_port: str) -> str:
+        """Return the name OpenSSH uses for the pod in known_hosts."""
+        return ssh_host if ssh_port == "22" else f"[{ssh_host}]:{ssh_port}"
 
-        # Ensure .ssh directory exists
-        self.known_hosts_path.parent.mkdir(parents=True, exist_ok=True)
+    def known_host_keys(self, ssh_host: str, ssh_port: str) -> set:
+        """Return the (key type, base64 key) pairs known_hosts already has for the pod."""
+        if not self.known_hosts_path.exists():
+            return set()
 
+        import subprocess
         try:
+            result = subprocess.run(
+                ["ssh-keygen", "-F", self.known_hosts_name(ssh_host, ssh_port), "-f", str(self.known_hosts_path)],
+                capture_output=True,
+                text=True,
+                timeout=10
+            )
+        except Exception:
+            return set()
+        if result.returncode != 0:
+            return set()
+        return {key for key in map(host_key_of, result.stdout.splitlines()) if key}
+
+    def fetch_host_keys(self, ssh_host: str, ssh_port: str) -> str:
+        """Fetch the pod's SSH host key(s) as hashed known_hosts lines."""
+        try:
+            import paramiko
+        except ImportError:
+            paramiko = None  # Fall back to the ssh-keyscan subprocess
+
+        if paramiko is None:
             import subprocess
             result = subprocess.run(
                 ["ssh-keyscan", "-p", ssh_port, "-H", ssh_host],
@@ -284,13 +486,72 @@ class PodManager:
                 text=True,
                 timeout=10
             )
+            if result.returncode != 0:
+                raise Exception(f"ssh-keyscan exited with status {result.returncode}")
+            return result.stdout
+
+        sock = socket.create_connection((ssh_host, int(ssh_port)), timeout=10)
+        try:
+            transport = paramiko.Transport(sock)
+            try:
+                transport.start_client(timeout=5)
+                key = transport.get_remote_server_key()
+            finally:
+                transport.close()
+        finally:
+            sock.close()
+
+        host_entry = paramiko.HostKeys.hash_host(self.known_hosts_name(ssh_host, ssh_port))
+        return f"{host_entry} {key.get_name()} {key.get_base64()}\n"
+
+    def start_host_key_scan(self, ssh_host: str, ssh_port: str) -> Future:
+        """Start fetching the pod's host keys in the background and return the future.
+
+        The fetch waits for the SSH port to accept connections first, since both
+        paramiko and ssh-keyscan fail immediately while sshd is still starting.
+        """
+        def scan_when_ready() -> str:
+            if not wait_for_port(ssh_host, ssh_port, SSH_READY_TIMEOUT_SECONDS):
+                raise Exception("SSH port did not open in time")
+            return self.fetch_host_keys(ssh_host, ssh_port)
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        scan = executor.submit(scan_when_ready)
+        executor.shutdown(wait=False)
+        return scan
+
+    def add_to_known_hosts(self, ssh_host: str, ssh_port: str, scan: Future):
+        """Add the pod's scanned host keys to SSH known_hosts."""
+        print("\nAdding pod to SSH known_hosts...")
+
+        # Ensure .ssh directory exists
+        self.known_hosts_path.parent.mkdir(parents=True, exist_ok=True)
 
-            if result.returncode == 0 and result.stdout:
-                with open(self.known_hosts_path, 'a') as f:
-                    f.write(result.stdout)
-                print("✓ Added to known_hosts successfully!")
+        try:
+            host_keys = scan.result(timeout=20)
+
+            if host_keys:
+                # Hashed host names are salted, so compare the keys themselves. An
+                # existing entry may be a stale key from an earlier pod on the same
+                # IP and port; the new key is still appended in that case.
+                seen = self.known_host_keys(ssh_host, ssh_port)
+                new_lines = []
+                for line in host_keys.splitlines():
+                    key = host_key_of(line)
+                    if key and key not in seen:
+                        seen.add(key)
+                        new_lines.append(line)
+                if new_lines:
+                    fd = os.open(self.known_hosts_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                    try:
+                        os.write(fd, ("\n".join(new_lines) + "\n").encode())
+                    finally:
+                        os.close(fd)
+                    print("✓ Added to known_hosts successfully!")
+                else:
+                    print("✓ Pod host key already in known_hosts")
             else:
-                print("⚠ ssh-keyscan may have failed, but continuing...")
+                print("⚠ Host key scan may have failed, but continuing...")
         except Exception as e:
             print(f"⚠ Could not add to known_hosts ({e}), but continuing...")
 
@@ -303,6 +564,12 @@ class PodManager:
         # Ensure .ssh directory exists
         self.ssh_config_path.parent.mkdir(parents=True, exist_ok=True)
 
+        # Skip if an entry for this pod already exists
+        if self.ssh_config_path.exists():
+            if f"Host {ssh_host_alias}\n".encode() in self.ssh_config_path.read_bytes():
+                print("✓ SSH config entry already present!")
+                return ssh_host_alias
+
         config_entry = f"""
 # RunPod Pod: {self.pod_name}
 Host {ssh_host_alias}
@@ -313,18 +580,24 @@ Host {ssh_host_alias}
     StrictHostKeyChecking no
 """
 
-        with open(self.ssh_config_path, 'a') as f:
-            f.write(config_entry)
+        # A single write() under O_APPEND keeps the entry atomic if launches race
+        fd = os.open(self.ssh_config_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, config_entry.encode())
+        finally:
+            os.close(fd)
 
         print("✓ SSH config updated!")
         return ssh_host_alias
 
-    def test_ssh_connection(self, ssh_host: str, ssh_port: str) -> bool:
-        """Test SSH connection to the pod."""
+    def wait_for_ssh_port(self, ssh_host: str, ssh_port: str) -> bool:
+        """Wait until the pod's SSH port accepts TCP connections."""
         print("\nWaiting for SSH service to be fully ready...")
-        time.sleep(15)
+        return wait_for_port(ssh_host, ssh_port, SSH_READY_TIMEOUT_SECONDS)
 
-        print("Testing SSH connection...")
+    def test_ssh_connection(self, ssh_host: str, ssh_port: str) -> bool:
+        """Test SSH connection to the pod."""
+        print("\nTesting SSH connection...")
 
         import subprocess
         cmd = [
@@ -393,20 +666,24 @@ Host {ssh_host_alias}
             print("=" * 60)
 
             # Create pod
-            pod_id = self.create_pod()
+            pod_id, pod_data = self.create_pod()
 
-            # Wait for pod to be running
-            self.wait_for_pod_running(pod_id)
+            # Wait for pod to be running and get SSH connection details
+            ssh_host, ssh_port = self.wait_for_pod_ready(pod_id, initial_pod_info=pod_data)
 
-            # Get SSH connection details
-            ssh_host, ssh_port = self.get_ssh_details(pod_id)
-
-            # Add to known_hosts
-            self.add_to_known_hosts(ssh_host, ssh_port)
+            # Fetch host keys in the background (once sshd accepts connections)
+            # while the SSH config is written and the SSH port is probed
+            host_key_scan = self.start_host_key_scan(ssh_host, ssh_port)
 
             # Update SSH config
             ssh_host_alias = self.update_ssh_config(pod_id, ssh_host, ssh_port)
 
+            # Wait for sshd to accept connections
+            self.wait_for_ssh_port(ssh_host, ssh_port)
+
+            # Add to known_hosts
+            self.add_to_known_hosts(ssh_host, ssh_port, host_key_scan)
+
             # Test SSH connection
             self.test_ssh_connection(ssh_host, ssh_port)
 